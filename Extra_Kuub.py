@@ -1,9 +1,18 @@
 import streamlit as st
-import pandas as pd
 import numpy as np
-import io
 import locale
 
+from pipeline import (
+    PYARROW_OK,
+    UPLOAD_TYPES,
+    compute_aggs,
+    filter_by_date,
+    load_and_prepare,
+    to_csv_bytes,
+    to_parquet_bytes,
+    to_xlsx_bytes,
+)
+
 try:
     locale.setlocale(locale.LC_TIME, 'nl_NL.UTF-8')
 except locale.Error:
@@ -17,11 +26,11 @@ st.set_page_config(page_title="Extra Afval Dashboard", layout="wide")
 
 st.title("🚛 Extra Afval Dashboard")
 st.write("""
-Analyseer automatisch extra afval per order en zie direct hoeveel **extra bakken** zijn geledigd.  
+Analyseer automatisch extra afval per order en zie direct hoeveel **extra bakken** zijn geledigd.
 Deze versie berekent het aantal extra bakken op basis van **Extra m³ / Volume per bak**.
 """)
 
-uploaded_file = st.file_uploader("📂 Upload je Excel-bestand", type=["xlsx"])
+uploaded_file = st.file_uploader("📂 Upload je Excel-bestand", type=UPLOAD_TYPES)
 
 def local_css(file_name):
     with open(file_name) as f:
@@ -30,63 +39,31 @@ def local_css(file_name):
 local_css("style.css")
 
 if uploaded_file:
-    # --- Slimme Excel-lezer ---
-    def read_excel_smart(uploaded_file):
-        temp_df = pd.read_excel(uploaded_file, header=None)
-        for i in range(len(temp_df)):
-            row_values = temp_df.iloc[i].astype(str).tolist()
-            if any(x in row_values for x in ["Ophaaldatum", "Locatienummer", "Klantnaam", "# uitgevoerd", "Extra m3"]):
-                df = pd.read_excel(uploaded_file, skiprows=i)
-                return df, i
-        # fallback: als er niets wordt gevonden
-        df = pd.read_excel(uploaded_file)
-        return df, 0
-
-    # --- Bestand inladen met automatische detectie ---
-    df, header_row = read_excel_smart(uploaded_file)
+    # --- Bestand inladen met automatische detectie (gecachet op de bytes) ---
+    df, header_row, missing_cols = load_and_prepare(uploaded_file.getvalue(), uploaded_file.name)
     st.success(f"✅ Bestand geladen vanaf rij {header_row + 1}")
 
     # Controle op verplichte kolommen
-    required_cols = ["Locatienummer", "Klantnaam", "Ophaaldatum", "Volume", "# uitgevoerd", "Extra m3"]
-    missing_cols = [c for c in required_cols if c not in df.columns]
     if missing_cols:
         st.error(f"❌ Ontbrekende kolommen: {', '.join(missing_cols)}")
         st.stop()
 
-    # --- Data voorbereiden ---
-    df["Ophaaldatum_dt"] = pd.to_datetime(df["Ophaaldatum"], errors="coerce", dayfirst=True)
-    df["Ophaaldatum"] = df["Ophaaldatum"].dt.strftime("%d-%m-%Y")
-
-
-    def clean_to_float(series):
-        return (
-            series.astype(str)
-            .str.replace(",", ".", regex=False)
-            .str.replace(r"[^\d\.]", "", regex=True)
-            .replace("", np.nan)
-            .astype(float)
-            .fillna(0)
+    # Na een xlsx-load een Parquet-kopie aanbieden: volgende sessies slaan
+    # het trage xlsx-parsen dan helemaal over.
+    if PYARROW_OK and uploaded_file.name.lower().endswith(".xlsx"):
+        st.download_button(
+            "💾 Bewaar als Parquet (sneller herladen)",
+            data=to_parquet_bytes(df),
+            file_name=uploaded_file.name.rsplit(".", 1)[0] + ".parquet",
+            mime="application/octet-stream",
         )
 
-    for col in ["Volume", "# uitgevoerd", "Extra m3"]:
-        if col in df.columns:
-            df[col] = clean_to_float(df[col])
-
-    # --- Berekeningen ---
-    df["Volume_m3"] = df["Volume"] / 1000  
-    df["Extra_bakken"] = df["Extra m3"] / df["Volume_m3"]
-    df["Extra_kuub"] = df["Extra m3"] + (df["Volume_m3"] * df["# uitgevoerd"])
-
     # --- Instellingen ---
     st.markdown("### 🎚️ Instellingen voor signalering")
     min_extra_bakken = st.slider("Minimaal aantal extra bakken (boven gepland)", 0.0, 10.0, 2.0, 0.1)
     min_extra_kuub = st.slider("Minimaal totaal extra volume (m³)", 0.0, 10.0, 1.0, 0.1)
 
-    # Zorg dat 'Ophaaldatum' in datetime blijft voor filtering
-    df["Ophaaldatum_dt"] = pd.to_datetime(df["Ophaaldatum"], errors="coerce", dayfirst=True)
-    df["Ophaaldatum_nl"] = df["Ophaaldatum_dt"].dt.strftime("%d-%m-%Y")
-    df["Ophaaldatum_kort"] = df["Ophaaldatum_dt"].dt.strftime("%a %d %b %Y")
-
+    # 'Ophaaldatum_dt' komt al als datetime uit load_and_prepare
     min_date = df["Ophaaldatum_dt"].min()
     max_date = df["Ophaaldatum_dt"].max()
 
@@ -99,25 +76,24 @@ if uploaded_file:
     )
     st.write(f"📅 Geselecteerde periode: {start_date.strftime('%d-%m-%Y')} t/m {end_date.strftime('%d-%m-%Y')}")
 
-    # Filter toepassen
-    df = df[(df["Ophaaldatum_dt"] >= pd.to_datetime(start_date)) & (df["Ophaaldatum_dt"] <= pd.to_datetime(end_date))]
-
-    # --- Dynamische filtering ---
-    df["Extra_bakken"] = df["Extra m3"] / (df["Volume"] / 1000)
-    df["Totaal_bakken"] = df["# uitgevoerd"] + df["Extra_bakken"]
-
-    # Eerst filteren op volume (alleen orders met veel extra kuub)
-    df_filtered_volume = df[df["Extra m3"] > min_extra_kuub]
+    # Filter toepassen (gecachet)
+    df = filter_by_date(df, start_date, end_date)
 
-    # Daarna binnen die subset kijken naar extra bakken
-    df_flagged = df_filtered_volume[df_filtered_volume["Extra_bakken"] > min_extra_bakken]
+    # --- Dynamische filtering + aggregaties (gecachet per drempels/periode) ---
+    daily, klant, locatie, df_flagged = compute_aggs(df, min_extra_bakken, min_extra_kuub)
 
     # === Dashboard Overzicht ===
     st.markdown("## 📈 Dashboard-overzicht")
-    total_kuub = df["Extra m3"].sum()
-    avg_kuub = df["Extra m3"].mean()
-    total_orders = len(df)
-    avg_extra_bakken = df["Extra_bakken"].mean()
+    # Eén pass over de twee kolommen in plaats van vier losse sum/mean-calls
+    extra_m3 = df["Extra m3"].to_numpy(dtype=np.float32)
+    extra_bakken = df["Extra_bakken"].to_numpy(dtype=np.float32)
+    total_orders = extra_m3.size
+    total_kuub = float(extra_m3.sum())
+    avg_kuub = total_kuub / total_orders if total_orders else 0.0
+    # Extra_bakken bevat NaN bij rijen zonder volume én extra m³ (0/0);
+    # net als .mean() die overslaan in plaats van het gemiddelde op NaN zetten
+    geldige_bakken = int(np.count_nonzero(~np.isnan(extra_bakken)))
+    avg_extra_bakken = float(np.nansum(extra_bakken)) / geldige_bakken if geldige_bakken else 0.0
 
     c1, c2, c3, c4 = st.columns(4)
     c1.metric("Totale extra kuub", f"{total_kuub:,.1f} m³")
@@ -127,66 +103,57 @@ if uploaded_file:
 
     # === Grafieken ===
     st.markdown("## 📊 Grafieken")
-    tab1, tab2, tab3 = st.tabs(["Per dag", "Per klant", "Per locatie"])
+    # st.tabs evalueert élk tabblad bij elke rerun, ook als de gebruiker er
+    # nooit op klikt. Een selector in session_state laat alleen de gekozen
+    # weergave rekenen; de aggregaties zelf blijven daarnaast gecachet.
+    actieve_tab = st.radio(
+        "Weergave",
+        ["Per dag", "Per klant", "Per locatie"],
+        horizontal=True,
+        key="active_tab",
+        label_visibility="collapsed",
+    )
 
-    with tab1:
-        daily = df.groupby("Ophaaldatum")["Extra m3"].sum().reset_index()
+    if actieve_tab == "Per dag":
         st.subheader("📆 Totaal extra m³ per dag")
-        st.line_chart(daily.set_index("Ophaaldatum"))
+        st.line_chart(daily.set_index("Ophaaldatum_dt"))
 
-    with tab2:
-        klant = df.groupby("Klantnaam")["Extra m3"].sum().sort_values(ascending=False).head(20)
+    elif actieve_tab == "Per klant":
         st.subheader("👥 Top 20 klanten met meeste extra afval")
         st.bar_chart(klant)
 
-    with tab3:
-        locatie = (
-            df_flagged.groupby("Locatienummer")
-            .agg(
-                Aantal_orders=("Ophaaldatum", "count"),
-                Gemiddeld_extra_bakken=("Extra_bakken", "mean"),
-                Totaal_extra_bakken=("Extra_bakken", "sum"),
-                Totaal_extra_kuub=("Extra m3", "sum"),
-            )
-            .sort_values("Aantal_orders", ascending=False)
-        )
+    else:
         st.subheader("🏭 Locaties met herhaald extra afval")
         st.dataframe(locatie)
-        st.bar_chart(locatie["Aantal_orders"].head(10))
+        st.bar_chart(locatie["Aantal_orders"].nlargest(10))
 
+        st.download_button(
+            "📥 Download overzicht per locatie",
+            to_csv_bytes(locatie, index=True),
+            "overzicht_per_locatie.csv",
+        )
 
-        csv = locatie.to_csv().encode("utf-8")
-        st.download_button("📥 Download overzicht per locatie", csv, "overzicht_per_locatie.csv")
-    
     #== Geflagde orders tonen ===
     st.subheader(f"🚩 Geflagde orders (> {min_extra_bakken} extra bakken of > {min_extra_kuub} m³)")
-    st.dataframe(df_flagged)
+    # Meer dan 1000 rijen is visueel toch niet te overzien; aftoppen scheelt renderwerk
+    st.dataframe(df_flagged.head(1000))
+    if len(df_flagged) > 1000:
+        st.caption(f"Eerste 1.000 van {len(df_flagged):,} geflagde orders; download hieronder voor alles.")
 
     # === Download flagged ===
-    csv_flagged = df_flagged.to_csv(index=False).encode("utf-8")
-
     if not df_flagged.empty:
-        # We behouden de kolomvolgorde van de originele data
-        originele_kolommen = list(df.columns)
-
-        # Alleen de geflagde rijen exporteren, met originele kolommen + nieuwe berekende kolommen
-        export_df = df_flagged.copy()
-        for col in ["Extra_bakken", "Totaal_bakken"]:
-            if col not in export_df.columns:
-                export_df[col] = np.nan
-
-        # Combineer kolommen: eerst originele, dan onze berekende extra’s
-        export_df = export_df[originele_kolommen + ["Extra_bakken", "Totaal_bakken"]]
-
-        # Excel-bestand maken in geheugen
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-            export_df.to_excel(writer, index=False, sheet_name="Geflagde orders")
-
-        # Terug naar streamlit-download knop
+        st.download_button(
+            label="📥 Download geflagde orders (CSV)",
+            data=to_csv_bytes(df_flagged),
+            file_name="geflagde_orders.csv",
+            mime="text/csv",
+        )
+        # Geflagde rijen exporteren; de berekende kolommen (Extra_bakken,
+        # Totaal_bakken) zitten sinds load_and_prepare al in de frame.
+        # De bytes komen uit de cache zolang de selectie niet wijzigt.
         st.download_button(
             label="📥 Download geflagde orders (Excel)",
-            data=output.getvalue(),
+            data=to_xlsx_bytes(df_flagged, "Geflagde orders"),
             file_name="geflagde_orders.xlsx",
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
         )
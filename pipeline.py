@@ -0,0 +1,295 @@
+"""Datapijplijn voor het Extra Afval Dashboard.
+
+Alle stappen (laden -> schonen -> verrijken -> filteren -> aggregeren ->
+exporteren) staan hier bij elkaar, los van de Streamlit-pagina. De zware
+stappen zijn gecachet met st.cache_data zodat reruns ze niet opnieuw doen.
+"""
+
+import io
+import re
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+# Parquet/feather alleen aanbieden als pyarrow beschikbaar is
+try:
+    import pyarrow  # noqa: F401
+    PYARROW_OK = True
+except ImportError:
+    PYARROW_OK = False
+
+UPLOAD_TYPES = ["xlsx", "parquet", "feather"] if PYARROW_OK else ["xlsx"]
+
+# Calamine (Rust) parseert xlsx vele malen sneller dan openpyxl; val terug
+# op openpyxl als het pakket niet is geïnstalleerd.
+try:
+    import python_calamine  # noqa: F401
+    _EXCEL_ENGINE = "calamine"
+except ImportError:
+    _EXCEL_ENGINE = "openpyxl"
+
+# Polars groupt multi-threaded over Arrow-buffers; zonder polars gewoon pandas.
+try:
+    import polars as pl
+except ImportError:
+    pl = None
+
+# Numba vectoriseert en parallelliseert de rekenkern over alle kernen;
+# zonder numba rekent load_and_prepare gewoon met numpy-expressies.
+try:
+    from numba import njit, prange
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _derive_kernel(volume, extra_m3, uitgevoerd, volume_m3, extra_bakken, extra_kuub, totaal_bakken):
+        for i in prange(volume.shape[0]):
+            v = volume[i] * np.float32(1e-3)
+            eb = extra_m3[i] / v
+            volume_m3[i] = v
+            extra_bakken[i] = eb
+            extra_kuub[i] = extra_m3[i] + v * uitgevoerd[i]
+            totaal_bakken[i] = uitgevoerd[i] + eb
+except ImportError:
+    _derive_kernel = None
+
+# Verplichte kolommen in het bronbestand
+required_cols = ["Locatienummer", "Klantnaam", "Ophaaldatum", "Volume", "# uitgevoerd", "Extra m3"]
+
+# Koppen waaraan we de kopregel herkennen
+_KOP_WAARDEN = ["Ophaaldatum", "Locatienummer", "Klantnaam", "# uitgevoerd", "Extra m3"]
+
+# Kolommen die als tekst binnenkomen en daarna door clean_to_float gaan
+_TEKST_KOLOMMEN = {
+    "Locatienummer": "string",
+    "Klantnaam": "string",
+    "Volume": "string",
+    "# uitgevoerd": "string",
+    "Extra m3": "string",
+}
+
+def _detect_header_row(frame):
+    # Gevectoriseerde isin over de hele frame in plaats van een Python-loop
+    # per rij; geeft None als er geen kopregel wordt gevonden.
+    mask = frame.isin(_KOP_WAARDEN).any(axis=1)
+    return int(mask.idxmax()) if mask.any() else None
+
+# --- Slimme Excel-lezer ---
+def read_excel_smart(excel_bytes):
+    # Kopregel zoeken op alleen de preambule: rapporten hebben de koppen
+    # vrijwel altijd in de eerste tientallen rijen, dus de rest van het
+    # blad hoeft voor detectie niet gelezen te worden.
+    preambule = pd.read_excel(io.BytesIO(excel_bytes), header=None, nrows=64, dtype=object, engine=_EXCEL_ENGINE)
+    i = _detect_header_row(preambule)
+    if i is None:
+        # fallback: als er niets wordt gevonden
+        return pd.read_excel(io.BytesIO(excel_bytes), engine=_EXCEL_ENGINE), 0
+    # Alleen de benodigde kolommen inlezen met vaste dtypes; bij openpyxl in
+    # read-only (streaming) modus zodat de cellen niet als boom in het
+    # geheugen worden opgebouwd.
+    engine_kwargs = {"read_only": True} if _EXCEL_ENGINE == "openpyxl" else {}
+    df = pd.read_excel(
+        io.BytesIO(excel_bytes),
+        skiprows=i,
+        usecols=lambda kolom: kolom in required_cols,
+        dtype=_TEKST_KOLOMMEN,
+        engine=_EXCEL_ENGINE,
+        engine_kwargs=engine_kwargs,
+    )
+    return df, i
+
+# Alles behalve cijfers en punten strippen (bv. "1,5 m³" -> "1.5")
+_NIET_NUMERIEK = re.compile(r"[^\d.]")
+
+def _naar_float(waarde):
+    if isinstance(waarde, str):
+        schoon = _NIET_NUMERIEK.sub("", waarde.replace(",", "."))
+        try:
+            return float(schoon)
+        except ValueError:
+            return 0.0
+    if isinstance(waarde, (int, float)) and waarde == waarde:
+        return float(waarde)
+    return 0.0
+
+def clean_to_float(series):
+    # float32 is ruim voldoende voor volumes (≤4 significante cijfers) en
+    # halveert de geheugenbandbreedte van de sommen en groupby's.
+    if pd.api.types.is_numeric_dtype(series):
+        return series.fillna(0).astype("float32")
+    # Comprehension over de onderliggende numpy-array is sneller dan de
+    # pandas .str-keten (geen Series-wrapping per bewerking).
+    vals = series.to_numpy()
+    return np.fromiter((_naar_float(v) for v in vals), dtype=np.float32, count=len(vals))
+
+def _read_upload(data_bytes, bestandsnaam):
+    # Parquet/feather lezen is ordes van grootte sneller dan xlsx; kolomselectie
+    # wordt daar naar de lezer gepusht.
+    naam = bestandsnaam.lower()
+    if naam.endswith((".parquet", ".feather")):
+        lezer = pd.read_parquet if naam.endswith(".parquet") else pd.read_feather
+        try:
+            return lezer(io.BytesIO(data_bytes), columns=required_cols), 0
+        except (KeyError, ValueError):
+            # bestand mist kolommen; volledig lezen zodat de controle het meldt
+            return lezer(io.BytesIO(data_bytes)), 0
+    return read_excel_smart(data_bytes)
+
+@st.cache_data(show_spinner=False)
+def load_and_prepare(data_bytes, bestandsnaam):
+    # Laadt, schoont en verrijkt het bestand één keer; reruns (sliders, datums)
+    # halen het resultaat uit de cache in plaats van opnieuw te parsen.
+    df, header_row = _read_upload(data_bytes, bestandsnaam)
+
+    missing_cols = [c for c in required_cols if c not in df.columns]
+    if missing_cols:
+        return df, header_row, missing_cols
+
+    # --- Data voorbereiden ---
+    # Vast formaat eerst proberen (C-fastpath); alleen bij afwijkende datums
+    # terugvallen op de trage dateutil-parser met dayfirst.
+    if pd.api.types.is_datetime64_any_dtype(df["Ophaaldatum"]):
+        df["Ophaaldatum_dt"] = df["Ophaaldatum"]
+    else:
+        try:
+            df["Ophaaldatum_dt"] = pd.to_datetime(df["Ophaaldatum"], format="%d-%m-%Y", errors="raise")
+        except (ValueError, TypeError):
+            df["Ophaaldatum_dt"] = pd.to_datetime(df["Ophaaldatum"], errors="coerce", dayfirst=True)
+    # Naar middernacht afkappen: bronbestanden met een tijdstip in de datum
+    # vallen anders buiten de bovengrens van het datumfilter (einddatum 00:00).
+    df["Ophaaldatum_dt"] = df["Ophaaldatum_dt"].dt.normalize()
+    # via _dt zodat dit ook werkt als de kolom al als tekst binnenkomt (parquet)
+    df["Ophaaldatum"] = df["Ophaaldatum_dt"].dt.strftime("%d-%m-%Y")
+    df["Ophaaldatum_nl"] = df["Ophaaldatum"]
+    df["Ophaaldatum_kort"] = df["Ophaaldatum_dt"].dt.strftime("%a %d %b %Y")
+
+    # category: groupby werkt dan op integer-codes in plaats van strings
+    df["Locatienummer"] = df["Locatienummer"].astype("category")
+    df["Klantnaam"] = df["Klantnaam"].astype("category")
+
+    for col in ["Volume", "# uitgevoerd", "Extra m3"]:
+        if col in df.columns:
+            df[col] = clean_to_float(df[col])
+
+    # --- Berekeningen: één pass, elke invoerkolom wordt één keer gelezen ---
+    volume = np.ascontiguousarray(df["Volume"].to_numpy(dtype=np.float32))
+    extra_m3 = np.ascontiguousarray(df["Extra m3"].to_numpy(dtype=np.float32))
+    uitgevoerd = np.ascontiguousarray(df["# uitgevoerd"].to_numpy(dtype=np.float32))
+    if _derive_kernel is not None:
+        volume_m3 = np.empty_like(volume)
+        extra_bakken = np.empty_like(volume)
+        extra_kuub = np.empty_like(volume)
+        totaal_bakken = np.empty_like(volume)
+        _derive_kernel(volume, extra_m3, uitgevoerd, volume_m3, extra_bakken, extra_kuub, totaal_bakken)
+    else:
+        volume_m3 = volume * np.float32(0.001)
+        extra_bakken = extra_m3 / volume_m3
+        extra_kuub = extra_m3 + volume_m3 * uitgevoerd
+        totaal_bakken = uitgevoerd + extra_bakken
+    df["Volume_m3"] = volume_m3
+    df["Extra_bakken"] = extra_bakken
+    df["Extra_kuub"] = extra_kuub
+    df["Totaal_bakken"] = totaal_bakken
+
+    if PYARROW_OK:
+        # Arrow-backed dtypes: st.dataframe serialiseert dan zero-copy naar
+        # Arrow in plaats van de hele frame per render te kopiëren.
+        # convert_integer=False: geschoonde kolommen moeten float blijven
+        df = df.convert_dtypes(dtype_backend="pyarrow", convert_integer=False)
+
+    return df, header_row, missing_cols
+
+@st.cache_data(show_spinner=False)
+def filter_by_date(df, start_date, end_date):
+    # Vergelijken op de int64-weergave van datetime64[ns]; gecachet op
+    # (df, periode) zodat slider-reruns het datumfilter niet opnieuw draaien.
+    ts = df["Ophaaldatum_dt"].to_numpy(dtype="datetime64[ns]").view("i8")
+    lo = np.datetime64(start_date, "ns").astype(np.int64)
+    hi = np.datetime64(end_date, "ns").astype(np.int64)
+    mask = (ts >= lo) & (ts <= hi)
+    return df.iloc[np.flatnonzero(mask)]
+
+# --- Gecachete aggregaties voor de weergaven ---
+@st.cache_data(show_spinner=False)
+def daily_totals(df):
+    # Groeperen op de datetime-kolom (int64-pad) in plaats van op de
+    # dd-mm-jjjj-strings; dat sorteert meteen ook chronologisch correct.
+    dagen = df["Ophaaldatum_dt"].astype("datetime64[ns]").dt.normalize()
+    if pl is not None:
+        return (
+            pl.DataFrame({"Ophaaldatum_dt": dagen, "Extra m3": df["Extra m3"].to_numpy(dtype=np.float32)})
+            .group_by("Ophaaldatum_dt")
+            .agg(pl.col("Extra m3").sum())
+            .sort("Ophaaldatum_dt")
+            .to_pandas()
+        )
+    return df.groupby(dagen, sort=False)["Extra m3"].sum().sort_index().reset_index()
+
+@st.cache_data(show_spinner=False)
+def klant_totals(df):
+    if pl is not None:
+        top = (
+            pl.from_pandas(df[["Klantnaam", "Extra m3"]])
+            .group_by("Klantnaam")
+            .agg(pl.col("Extra m3").sum())
+            .top_k(20, by="Extra m3")
+            .sort("Extra m3", descending=True)
+            .to_pandas()
+        )
+        return top.set_index("Klantnaam")["Extra m3"]
+    # nlargest doet een partiële heap-selectie in plaats van alles te sorteren
+    return df.groupby("Klantnaam", sort=False, observed=True)["Extra m3"].sum().nlargest(20)
+
+@st.cache_data(show_spinner=False)
+def locatie_overzicht(df_flagged):
+    if pl is not None:
+        overzicht = (
+            pl.from_pandas(df_flagged[["Locatienummer", "Ophaaldatum", "Extra_bakken", "Extra m3"]])
+            .group_by("Locatienummer")
+            .agg(
+                Aantal_orders=pl.col("Ophaaldatum").count(),
+                Gemiddeld_extra_bakken=pl.col("Extra_bakken").mean(),
+                Totaal_extra_bakken=pl.col("Extra_bakken").sum(),
+                Totaal_extra_kuub=pl.col("Extra m3").sum(),
+            )
+            .sort("Aantal_orders", descending=True)
+            .to_pandas()
+        )
+        return overzicht.set_index("Locatienummer")
+    return (
+        df_flagged.groupby("Locatienummer", sort=False, observed=True)
+        .agg(
+            Aantal_orders=("Ophaaldatum", "count"),
+            Gemiddeld_extra_bakken=("Extra_bakken", "mean"),
+            Totaal_extra_bakken=("Extra_bakken", "sum"),
+            Totaal_extra_kuub=("Extra m3", "sum"),
+        )
+        .sort_values("Aantal_orders", ascending=False)
+    )
+
+@st.cache_data(show_spinner=False)
+def compute_aggs(df, min_extra_bakken, min_extra_kuub):
+    # Signalering plus alle drie de aggregaties in één gecachete call: per
+    # (periode, drempels)-combinatie wordt er precies één keer gerekend,
+    # daarna zijn alle weergaven gratis.
+    flagged = df.loc[(df["Extra m3"] > min_extra_kuub) & (df["Extra_bakken"] > min_extra_bakken)]
+    return daily_totals(df), klant_totals(df), locatie_overzicht(flagged), flagged
+
+# --- Gecachete exportbestanden ---
+@st.cache_data(show_spinner=False)
+def to_parquet_bytes(df):
+    return df.to_parquet(index=False, engine="pyarrow")
+
+@st.cache_data(show_spinner=False)
+def to_csv_bytes(df, index=False):
+    return df.to_csv(index=index).encode("utf-8")
+
+@st.cache_data(show_spinner=False)
+def to_xlsx_bytes(df, sheet_name):
+    # Gecachet: Streamlit bouwt de downloadknop bij elke rerun, niet pas bij
+    # een klik. Geen constant_memory: die modus flusht rijen direct weg,
+    # terwijl to_excel cellen kolom-voor-kolom schrijft — dat levert een
+    # bestand op waarin alleen de eerste kolom gevuld is.
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
+        df.to_excel(writer, index=False, sheet_name=sheet_name)
+    return output.getvalue()